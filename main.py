@@ -1,15 +1,48 @@
 from fastapi import FastAPI, UploadFile, HTTPException, Request, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
+import asyncio
 import io
+import os
 import re
-from typing import List, Dict, Any, Tuple
+import sys
+import hashlib
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from pdfminer.high_level import extract_pages
 from pdfminer.layout import LTTextContainer, LTChar, LTLine, LTTextLineHorizontal
-from statistics import mean
+
+# PDF backend: pdfminer by default. Setting CV_PARSER_PDF_BACKEND=pymupdf opts in
+# to the faster (AGPL licensed) PyMuPDF, which must then be installed separately
+PDF_BACKEND = os.environ.get("CV_PARSER_PDF_BACKEND", "pdfminer").lower()
+if PDF_BACKEND == "pymupdf":
+    import pymupdf
+elif PDF_BACKEND != "pdfminer":
+    raise ValueError(f"Unknown CV_PARSER_PDF_BACKEND: {PDF_BACKEND!r}")
+
+# Parallel lists of y, x, text and font size for the text lines of a page
+PageElements = Tuple[List[float], List[float], List[str], List[Optional[float]]]
+
+# Matches page footers such as "Page 1 of 3"
+PAGE_NUMBER_PATTERN = re.compile(r'^Page \d+ of \d+$')
+
+# Standard CV section titles, always treated as headers regardless of formatting
+COMMON_HEADERS = frozenset({
+    "EDUCATION", "EXPERIENCE", "WORK EXPERIENCE", "SKILLS", "PROJECTS",
+    "LANGUAGES", "CERTIFICATIONS", "REFERENCES", "SUMMARY", "OBJECTIVE", "CONTACT",
+})
+
+# Parse results of recent uploads keyed by content hash, least recently used first
+PARSE_CACHE_SIZE = 64
+parse_cache: "OrderedDict[bytes, List[Dict[str, Any]]]" = OrderedDict()
+
+# Upper bound on PDFs parsed at the same time; created lazily on the server's event loop
+MAX_CONCURRENT_PARSES = os.cpu_count() or 1
+parse_semaphore: Optional[asyncio.Semaphore] = None
 
 
 
@@ -31,49 +64,56 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def process_text_with_pdfminer(pdf_file) -> Dict[str, Any]:
+def process_text_with_pdfminer(pdf_file) -> Tuple[List[Dict[str, Any]], List[str]]:
     """
-    Process CV text using pdfminer based purely on formatting and layout.
+    Process CV text based purely on formatting and layout.
     Using the same order as raw text extraction.
+    Returns the sections together with the raw text lines they were built from.
+    """
+    # Walk the PDF once, getting text in correct order along with font sizes
+    raw_text, text_properties = extract_text_lines(pdf_file)
+    return classify_sections(raw_text, text_properties), raw_text
+
+def classify_sections(raw_text: List[str], text_properties: Dict[str, float]) -> List[Dict[str, Any]]:
+    """
+    Group text lines in reading order into header sections and their content,
+    using the font size of each text from extract_text_lines.
     """
-    # First get the raw text in correct order
-    raw_text = extract_raw_text(pdf_file)
-    
-    # Reset file pointer
-    pdf_file.seek(0)
-    
-    # Collect font sizes for each text element
-    text_properties = {}
-    for page_layout in extract_pages(pdf_file):
-        for element in page_layout:
-            if isinstance(element, LTTextContainer):
-                for text_line in element:
-                    if isinstance(text_line, LTTextLineHorizontal):
-                        chars = [char for char in text_line if isinstance(char, LTChar)]
-                        if chars:
-                            text = text_line.get_text().strip()
-                            if text and not re.match(r'^Page \d+ of \d+$', text):
-                                size = mean(char.size for char in chars)
-                                text_properties[text] = size
-    
     if not text_properties:
         return []
     
     # Calculate average font size
-    avg_font_size = mean(text_properties.values())
+    avg_font_size = sum(text_properties.values()) / len(text_properties)
+    header_font_size = avg_font_size + 0.7
+    
+    # With (near) uniform font sizes no line reaches the header threshold,
+    # so only the text based checks can identify headers
+    uses_font_size = max(text_properties.values()) >= header_font_size
     
     def is_header(text: str) -> bool:
-        """Determine if text is likely a header based only on formatting"""
-        font_size = text_properties.get(text, avg_font_size)
+        """Determine if text is likely a header from common section titles and formatting"""
+        if text.upper() in COMMON_HEADERS:
+            return True
         return (
             text.isupper() or  # All caps text
             (
-                font_size >= avg_font_size + 0.7 and  # Font size threshold
+                uses_font_size and
+                text_properties.get(text, avg_font_size) >= header_font_size and  # Font size threshold
                 len(text.split()) <= 2 and            # Word count threshold
                 not text.endswith(('.', ','))         # Not a sentence
             )
         )
     
+    # Classify each distinct line once; repeated lines reuse the result
+    header_flags = {text: is_header(text) for text in set(raw_text)}
+    
+    def add_buffered_content(section: Dict[str, Any], buffer: List[str]) -> None:
+        """Add buffered lines to the section as a single content entry"""
+        section.setdefault("content", []).append({
+            "depth": section["depth"] + 1,
+            "text": " ".join(buffer)
+        })
+    
     sections = []
     current_section = None
     buffer = []
@@ -89,21 +129,16 @@ def process_text_with_pdfminer(pdf_file) -> Dict[str, Any]:
             continue
         
         # Handle section headers
-        if is_header(text):
+        if header_flags[text]:
             # Process any buffered content before starting new section
             if buffer and current_section:
-                if "content" not in current_section:
-                    current_section["content"] = []
-                current_section["content"].append({
-                    "depth": current_section["depth"] + 1,
-                    "text": " ".join(buffer)
-                })
+                add_buffered_content(current_section, buffer)
                 buffer = []
             
-            # Create new section
+            # Create new section; header titles recur across CVs, so share one copy
             current_section = {
                 "depth": 1,
-                "text": text
+                "text": sys.intern(text)
             }
             sections.append(current_section)
         else:
@@ -112,45 +147,129 @@ def process_text_with_pdfminer(pdf_file) -> Dict[str, Any]:
     
     # Process any remaining buffer
     if buffer and current_section:
-        if "content" not in current_section:
-            current_section["content"] = []
-        current_section["content"].append({
-            "depth": current_section["depth"] + 1,
-            "text": " ".join(buffer)
-        })
+        add_buffered_content(current_section, buffer)
     
     return sections
 
-def extract_raw_text(pdf_file) -> List[str]:
-    """Extract raw text from PDF with layout consideration."""
+def is_filler(text: str) -> bool:
+    """Check if a stripped text line should be dropped (empty or page footer)."""
+    return not text or (text.startswith('Page ') and PAGE_NUMBER_PATTERN.match(text) is not None)
+
+def walk_page(page_layout) -> PageElements:
+    """
+    Collect y, x, text and font size for every text line on a page as
+    parallel lists. Font size is None for lines without character data.
+    """
+    ys, xs, texts, sizes = [], [], [], []
+    for element in page_layout:
+        if isinstance(element, LTTextContainer):
+            y_pos = element.y1  # top position
+            x_pos = element.x0  # left position
+            
+            for text_line in element:
+                if isinstance(text_line, LTTextLineHorizontal):
+                    text = text_line.get_text().strip()
+                    if not is_filler(text):
+                        size_sum = 0.0
+                        n = 0
+                        for char in text_line:
+                            # Exact type check: pdfminer yields plain LTChar/LTAnno here
+                            if type(char) is LTChar:
+                                size_sum += char.size
+                                n += 1
+                        ys.append(y_pos)
+                        xs.append(x_pos)
+                        texts.append(text)
+                        sizes.append(size_sum / n if n else None)
+    return ys, xs, texts, sizes
+
+def walk_pymupdf_page(page) -> PageElements:
+    """
+    PyMuPDF counterpart of walk_page. PyMuPDF measures y from the top of the
+    page, so it is negated to sort the same way as pdfminer coordinates.
+    Only horizontal lines are kept, matching walk_page.
+    """
+    ys, xs, texts, sizes = [], [], [], []
+    for block in page.get_text("dict")["blocks"]:
+        if block["type"] != 0:  # skip image blocks
+            continue
+        x_pos, y_top = block["bbox"][0], block["bbox"][1]
+        
+        for line in block["lines"]:
+            if line["dir"] != (1.0, 0.0):  # skip vertical and rotated lines
+                continue
+            spans = line["spans"]
+            text = "".join(span["text"] for span in spans).strip()
+            if not is_filler(text):
+                # Weight span sizes by character count to match the per-char mean
+                size_sum = 0.0
+                n = 0
+                for span in spans:
+                    size_sum += span["size"] * len(span["text"])
+                    n += len(span["text"])
+                ys.append(-y_top)
+                xs.append(x_pos)
+                texts.append(text)
+                sizes.append(size_sum / n if n else None)
+    return ys, xs, texts, sizes
+
+def iter_page_elements(pdf_file):
+    """Yield the text elements of each page using the configured backend."""
+    if PDF_BACKEND == "pymupdf":
+        # PyMuPDF only opens in-memory streams, so the whole upload is read here
+        with pymupdf.open(stream=pdf_file.read(), filetype="pdf") as doc:
+            for page in doc:
+                yield walk_pymupdf_page(page)
+    else:
+        for page_layout in extract_pages(pdf_file):
+            yield walk_page(page_layout)
+
+def extract_text_lines(pdf_file) -> Tuple[List[str], Dict[str, float]]:
+    """
+    Extract text lines from PDF with layout consideration, in a single pass.
+    Returns the lines in reading order and the font size of each text. Sizes
+    are recorded in document order, so for text repeated at different sizes
+    the last occurrence in the document wins.
+    """
     raw_text = []
+    font_sizes = {}
     
-    for page_layout in extract_pages(pdf_file):
-        # Group text elements by their vertical position
-        elements = []
-        for element in page_layout:
-            if isinstance(element, LTTextContainer):
-                y_pos = element.y1  # top position
-                x_pos = element.x0  # left position
-                
-                for text_line in element:
-                    if isinstance(text_line, LTTextLineHorizontal):
-                        text = text_line.get_text().strip()
-                        if text and not re.match(r'^Page \d+ of \d+$', text):
-                            elements.append((y_pos, x_pos, text))
+    # Group text elements by their vertical position
+    for ys, xs, texts, sizes in iter_page_elements(pdf_file):
+        # Record font sizes before sorting, in document order
+        for text, size in zip(texts, sizes):
+            if size is not None:
+                font_sizes[text] = size
         
-        # Sort by vertical position first (top to bottom), then horizontal (left to right)
-        elements.sort(key=lambda x: (-x[0], x[1]))
+        # Sort indices by vertical position first (top to bottom), then horizontal
+        # (left to right); both sorts are stable so ties keep document order
+        order = sorted(range(len(texts)), key=xs.__getitem__)
+        order.sort(key=ys.__getitem__, reverse=True)
         
         # Add sorted text to raw_text
-        for _, _, text in elements:
-            raw_text.append(text)
+        raw_text.extend(texts[i] for i in order)
     
-    return raw_text
+    return raw_text, font_sizes
+
+def file_digest(pdf_file, chunk_size: int = 1 << 16) -> bytes:
+    """Hash the file contents, leaving the file pointer at the start."""
+    digest = hashlib.blake2b(digest_size=16)
+    pdf_file.seek(0)
+    for chunk in iter(lambda: pdf_file.read(chunk_size), b""):
+        digest.update(chunk)
+    pdf_file.seek(0)
+    return digest.digest()
+
+def get_parse_semaphore() -> asyncio.Semaphore:
+    """Return the semaphore bounding concurrent parses, creating it on first use."""
+    global parse_semaphore
+    if parse_semaphore is None:
+        parse_semaphore = asyncio.Semaphore(MAX_CONCURRENT_PARSES)
+    return parse_semaphore
 
 @app.post("/parse-cv/")
 @limiter.limit("10/minute")
-async def parse_cv(request: Request, file: UploadFile = File(...)) -> JSONResponse:
+async def parse_cv(request: Request, file: UploadFile = File(...)) -> ORJSONResponse:
     """
     Parse uploaded CV/Resume PDF and return both raw and structured JSON.
     Rate limited to 10 requests per minute.
@@ -164,26 +283,32 @@ async def parse_cv(request: Request, file: UploadFile = File(...)) -> JSONRespon
         raise HTTPException(status_code=400, detail="Error: file is not a PDF")
     
     try:
-        # Read the uploaded file
-        content = await file.read()
-        if not content:
+        # Parse straight from the spooled upload file rather than copying it into memory
+        pdf_file = file.file
+        pdf_file.seek(0, io.SEEK_END)
+        if pdf_file.tell() == 0:
             raise HTTPException(status_code=400, detail="Error:Empty file uploaded")
             
-        pdf_file = io.BytesIO(content)
-        
-        # Get raw text
-        raw_text = extract_raw_text(pdf_file)
-        
-        # Reset file pointer for processing
-        pdf_file.seek(0)
-        
-        # Process PDF using pdfminer
-        structured_data = process_text_with_pdfminer(pdf_file)
+        # Identical uploads always parse the same, so reuse earlier results.
+        # Hashing reads the file, which may be spooled to disk, so keep it off the loop
+        key = await run_in_threadpool(file_digest, pdf_file)
+        if key in parse_cache:
+            parse_cache.move_to_end(key)
+            structured_data = parse_cache[key]
+        else:
+            # Process PDF off the event loop since parsing is blocking.
+            # Raw text comes from the same parse, so no second pass is needed for it.
+            # Bound concurrent parses so bursts queue here instead of contending for CPU
+            async with get_parse_semaphore():
+                structured_data, raw_text = await run_in_threadpool(process_text_with_pdfminer, pdf_file)
+            parse_cache[key] = structured_data
+            if len(parse_cache) > PARSE_CACHE_SIZE:
+                parse_cache.popitem(last=False)
         
         # Return both raw and structured data
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "result": {
-                #"raw_text": raw_text, # Uncomment to return raw text FOR DEBUGGING
+                #"raw_text": raw_text, # Uncomment to return raw text FOR DEBUGGING (cache misses only)
                 "data": structured_data
             }
         })